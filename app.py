@@ -1,23 +1,106 @@
 # main.py
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from motor.motor_asyncio import AsyncIOMotorClient
+from cachetools import TTLCache
 import os
-import traceback
-from predictor import get_live_forecast
+import logging
+import asyncio
+import functools
+import importlib
+import time
+
+# predictor pulls in pandas and Prophet, so it is imported in a worker thread
+# after startup (see _get_predictor) instead of at module load
+from db import MONGO_URI, DB_NAME, COLLECTION_NAME, SERVER_SELECTION_TIMEOUT_MS
+
+# Raise LOG_LEVEL (e.g. WARNING) in production to skip per-request messages
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    format="%(asctime)s [%(levelname)s] %(message)s"
+)
 
 app = FastAPI(
     title="Agricultural Price Forecast API",
-    description="An API to get 7-day price forecasts for all districts."
+    description="An API to get 7-day price forecasts for all districts.",
+    default_response_class=ORJSONResponse
 )
 
+# Forecasts only change when the daily fetch writes new prices, so each
+# rendered /forecast body is reused per district/crop/variety for an hour.
+# Only touched from the event loop thread, so no lock is needed.
+FORECAST_CACHE_SECONDS = int(os.getenv("FORECAST_CACHE_SECONDS", 3600))
+_forecast_cache = TTLCache(maxsize=1024, ttl=FORECAST_CACHE_SECONDS)
+
+# The predictor module once imported; _predictor_lock keeps concurrent first
+# requests from importing it twice
+_predictor = None
+_predictor_lock = asyncio.Lock()
+
+async def _get_predictor():
+    """
+    Imports predictor in the default executor on first use and caches it, so
+    the slow import never runs on the event loop. A failed import is not
+    cached and is retried, again off the loop, by the next caller.
+    """
+    global _predictor
+    if _predictor is None:
+        async with _predictor_lock:
+            if _predictor is None:
+                loop = asyncio.get_running_loop()
+                _predictor = await loop.run_in_executor(None, importlib.import_module, "predictor")
+    return _predictor
+
+async def _warm_predictor():
+    try:
+        await _get_predictor()
+    except Exception:
+        logging.exception("Importing predictor failed; retrying on the next /forecast")
+
 class ForecastRequest(BaseModel):
     crop_name: str
     variety_name: str
     district_name: str # <-- Botpress MUST send this
 
-@app.get("/test-files")
-def test_files():
+@app.on_event("startup")
+async def open_motor_client():
+    # Without a URI Motor would quietly target localhost; refuse to start instead
+    if not MONGO_URI:
+        logging.critical("FATAL ERROR: MONGO_URI environment variable is not set.")
+        raise RuntimeError("MONGO_URI not configured.")
+
+    # Async driver for request handlers, so Mongo reads don't block the event loop.
+    # The selection timeout matches db.py, so an unreachable server fails a
+    # request in seconds rather than after Motor's 30 s default
+    app.state.motor_client = AsyncIOMotorClient(
+        MONGO_URI,
+        maxPoolSize=200,
+        compressors="zstd,snappy",
+        serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS
+    )
+    app.state.db = app.state.motor_client[DB_NAME]
+
+    # Warm the pool once per worker; indexes are maintained by the fetch job
+    try:
+        await app.state.db.command("ping")
+    except Exception:
+        logging.exception("MongoDB warm-up failed")
+
+    # Start the predictor import in the background: startup isn't delayed
+    # and the first /forecast usually finds it done
+    app.state.predictor_warmup = asyncio.create_task(_warm_predictor())
+
+@app.on_event("shutdown")
+async def close_motor_client():
+    client = getattr(app.state, "motor_client", None)
+    if client is not None:
+        client.close()
+
+@functools.lru_cache(maxsize=8)
+def _list_files(bucket):
+    # `bucket` only changes every 10 seconds, so bursts of hits reuse one listing
     root_path = "./"
     models_path = "./models"
     root_files = os.listdir(root_path)
@@ -31,6 +114,10 @@ def test_files():
         "files_in_models_folder (./models)": models_files
     }
 
+@app.get("/test-files")
+def test_files():
+    return _list_files(int(time.time()) // 10)
+
 @app.get("/")
 def read_root():
     return {"status": "Forecast API is running."}
@@ -38,28 +125,76 @@ def read_root():
 @app.post("/forecast")
 async def get_forecast(request: ForecastRequest):
     try:
-        print(f"Received request for: {request.district_name}, {request.crop_name}, {request.variety_name}")
+        logging.info(
+            "Received request for: %s, %s, %s",
+            request.district_name, request.crop_name, request.variety_name
+        )
+
+        cache_key = (request.district_name, request.crop_name, request.variety_name)
+        cached_body = _forecast_cache.get(cache_key)
+        if cached_body is not None:
+            return Response(content=cached_body, media_type="application/json")
         
-        forecast_df = get_live_forecast(
-            district_name=request.district_name,
-            crop_name=request.crop_name, 
-            variety_name=request.variety_name
+        predictor = await _get_predictor()
+
+        # One indexed lookup for the newest record with usable prices
+        record = await app.state.db[COLLECTION_NAME].find_one(
+            predictor.latest_valid_record_query(
+                request.district_name, request.crop_name, request.variety_name
+            ),
+            predictor.LATEST_RECORD_PROJECTION,
+            sort=predictor.LATEST_RECORD_SORT
         )
+
+        forecast_df = None
+        if record is not None:
+            # Model loading and Prophet are blocking; keep them off the event loop
+            loop = asyncio.get_running_loop()
+            forecast_df = await loop.run_in_executor(None, functools.partial(
+                predictor.forecast_from_features,
+                district_name=request.district_name,
+                crop_name=request.crop_name,
+                variety_name=request.variety_name,
+                features=predictor.features_from_record(record)
+            ))
         
         if forecast_df is None:
             raise HTTPException(status_code=404, detail=f"Could not generate forecast. No model or recent data for {request.district_name}.")
             
-        forecast_json = forecast_df.to_dict(orient="records")
-        return {"forecast": forecast_json}
+        # Box each column once with .tolist() and zip the rows back together.
+        # Dates are pre-formatted because orjson cannot encode pandas Timestamps.
+        forecast_df["ds"] = forecast_df["ds"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+        columns = list(forecast_df.columns)
+        forecast_json = [
+            dict(zip(columns, row))
+            for row in zip(*(forecast_df[c].tolist() for c in columns))
+        ]
+        # Returning the response directly skips FastAPI's jsonable_encoder pass
+        response = ORJSONResponse({"forecast": forecast_json})
+        _forecast_cache[cache_key] = response.body
+        return response
     except Exception as e:
-        print(f"Error during forecast: {traceback.format_exc()}")
+        logging.exception("Error during forecast")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
-    # Directly provide the app object instead of string reference
-    uvicorn.run(app, host="0.0.0.0", port=port, reload=False)
+    workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+    # Auto-reload is for local development only; it runs a file watcher and
+    # cannot be combined with multiple workers
+    dev_mode = os.getenv("ENV") == "dev"
+    # Multiple workers need the import string rather than the app object
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=port,
+        workers=1 if dev_mode else workers,
+        loop="uvloop",
+        http="httptools",
+        reload=dev_mode,
+        reload_dirs=["./"] if dev_mode else None
+    )
 
 
 
@@ -0,0 +1,45 @@
+# convert_models.py
+#
+# Optional one-off: re-saves every model in MODEL_DIR with lz4 compression.
+# Usage: pip install lz4 && python convert_models.py [model_dir]
+#
+# The committed models are plain, uncompressed pickles. Compressed ones are
+# about 40% of the size and load through the same joblib.load in predictor,
+# but the deploy then needs lz4 installed as well.
+
+import os
+import sys
+import glob
+import logging
+import joblib
+
+from predictor import MODEL_DIR
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+
+def convert(path):
+    """Rewrites one model file in place via a temp file, so a failed dump never truncates it."""
+    model = joblib.load(path)
+    tmp_path = path + ".tmp"
+    joblib.dump(model, tmp_path, compress=("lz4", 3))
+    before, after = os.path.getsize(path), os.path.getsize(tmp_path)
+    os.replace(tmp_path, path)
+    logging.info("%s: %d -> %d bytes", path, before, after)
+
+
+def main(model_dir):
+    paths = sorted(glob.glob(os.path.join(model_dir, "*.joblib")))
+    if not paths:
+        logging.warning("No .joblib files found in %s", model_dir)
+        return
+
+    for path in paths:
+        try:
+            convert(path)
+        except Exception as e:
+            logging.error("Could not convert %s: %s", path, str(e))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else MODEL_DIR)
@@ -0,0 +1,44 @@
+# db.py
+
+import os
+from pymongo import MongoClient
+
+# --- CONFIG ---
+MONGO_URI = os.getenv("MONGO_URI")
+DB_NAME = "agriculture_db"
+COLLECTION_NAME = "recent_crop_prices"
+# How long a request waits for a reachable server before failing; shared by
+# the pymongo client here and the API's Motor client
+SERVER_SELECTION_TIMEOUT_MS = 10000
+
+_client = None
+_collection = None
+
+
+def get_client():
+    """
+    Returns the process-wide MongoClient, creating it on first use.
+    The fetch job, the predictor and the Flask webapp all share it, so each
+    process pays for one TLS handshake and one connection pool.
+    """
+    global _client
+    if _client is None:
+        _client = MongoClient(
+            MONGO_URI,
+            maxPoolSize=20,
+            minPoolSize=1,
+            maxIdleTimeMS=300_000,
+            serverSelectionTimeoutMS=SERVER_SELECTION_TIMEOUT_MS,
+            retryReads=True,
+            # Repeated field names make price documents very compressible
+            compressors="zstd,snappy",
+        )
+    return _client
+
+
+def get_collection():
+    """Returns the cached handle for the price collection."""
+    global _collection
+    if _collection is None:
+        _collection = get_client()[DB_NAME][COLLECTION_NAME]
+    return _collection
@@ -1,23 +1,39 @@
 # fetch_mandi_data.py
 
 import os
+import sys
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import logging
 import traceback
-from pymongo import MongoClient, UpdateOne
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ReplaceOne
 from datetime import datetime, timedelta
+from db import MONGO_URI, get_client, get_collection
 
 # --- CONFIG ---
 RESOURCE_ID = "9ef84268-d588-465a-a308-a864a43d0070"
 API_KEY = os.getenv("DATA_GOV_API_KEY") or ""
-MONGO_URI = os.getenv("MONGO_URI")
-DB_NAME = "agriculture_db"
-COLLECTION_NAME = "recent_crop_prices"
 LIMIT = 499
+MAX_PAGES = 20
+FETCH_WORKERS = 8
+FIELDS = "commodity,state,district,market,variety,arrival_date,min_price,max_price,modal_price"
+
+# Price columns, stored in MongoDB as whole rupees (int32)
+PRICE_COLS = ["min_price", "max_price", "modal_price"]
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+
+# Compound key that uniquely identifies a mandi price record
+KEY_FIELDS = ("commodity", "variety", "state", "district", "market", "arrival_date")
+
+# Upserts per bulk_write call; keeps each command well under MongoDB's 16 MB limit
+BULK_CHUNK_SIZE = 1000
 
 # Filter Constants
-COMMODITIES_TO_KEEP = ["Onion"]
+COMMODITIES_TO_KEEP = frozenset(["Onion"])
 DAYS_TO_KEEP = 20
 
 # ⭐ STATE AND DISTRICT FILTERING CONSTANTS (For Maharashtra) ⭐
@@ -30,32 +46,101 @@ TARGET_DISTRICTS = [
     "Sholapur", "Thane", "Wardha"
 ]
 
+# Case-folded lookups for the case-insensitive filters, built once at import
+COMMODITIES_LC = frozenset(c.casefold() for c in COMMODITIES_TO_KEEP)
+TARGET_STATE_LC = TARGET_STATE.casefold()
+TARGET_DISTRICTS_LC = frozenset(d.casefold() for d in TARGET_DISTRICTS)
+
 # Logging to stdout so Render captures it
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
 
 # --- DATA FETCHING ---
-def fetch_data():
-    """Fetches the latest mandi price data from the data.gov.in API."""
-    if not API_KEY:
-        logging.error("DATA_GOV_API_KEY is not set in environment.")
-        return []
+# One keep-alive session shared by all page requests, sized for the fetch pool.
+# requests already negotiates gzip/deflate, so only the JSON Accept is added.
+_session = requests.Session()
+_session.headers.update({"Accept": "application/json"})
+_session.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=FETCH_WORKERS,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+    )
+))
 
-    fields = "commodity,state,district,market,variety,arrival_date,min_price,max_price,modal_price"
 
+def _fetch_page(offset):
+    """Fetches one page of records starting at `offset` and returns the JSON payload."""
     url = (
         f"https://api.data.gov.in/resource/{RESOURCE_ID}"
-        f"?api-key={API_KEY}&format=json&offset=0&limit={LIMIT}&fields={fields}"
+        f"?api-key={API_KEY}&format=json&offset={offset}&limit={LIMIT}&fields={FIELDS}"
     )
     logging.info("Requesting URL: %s", url)
 
+    r = _session.get(url, timeout=30)
+    r.raise_for_status()
+    return orjson.loads(r.content)
+
+
+def _fetch_extra_page(offset):
+    """Like _fetch_page, but logs and skips a failed page instead of raising."""
     try:
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
-        payload = r.json()
+        return _fetch_page(offset).get("records", [])
+    except Exception as e:
+        logging.error("Request for offset %d failed: %s", offset, str(e))
+        return []
+
+
+def fetch_data():
+    """
+    Fetches the latest mandi price data from the data.gov.in API.
+    The first page reports the total record count; remaining pages are
+    fetched concurrently, up to MAX_PAGES pages in all. If the count is
+    missing, pages are read in order until one comes back short.
+    """
+    if not API_KEY:
+        logging.error("DATA_GOV_API_KEY is not set in environment.")
+        return []
+
+    try:
+        payload = _fetch_page(0)
         records = payload.get("records", [])
-        logging.info("Fetched %d records from API", len(records))
-        return records
+
+        total = int(payload.get("total") or 0)
+        if total:
+            offsets = range(LIMIT, min(total, LIMIT * MAX_PAGES), LIMIT)
+            if offsets:
+                with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+                    for page in executor.map(_fetch_extra_page, offsets):
+                        records.extend(page)
+            if total > LIMIT * MAX_PAGES:
+                logging.warning(
+                    "API reports %d records but only %d pages are read (MAX_PAGES); fetched %d records.",
+                    total, MAX_PAGES, len(records)
+                )
+        else:
+            page = records
+            offset = LIMIT
+            while len(page) >= LIMIT and offset < LIMIT * MAX_PAGES:
+                page = _fetch_extra_page(offset)
+                records.extend(page)
+                offset += LIMIT
+            if len(page) >= LIMIT:
+                logging.warning(
+                    "Stopped after %d pages (MAX_PAGES) with more records likely remaining; fetched %d records.",
+                    MAX_PAGES, len(records)
+                )
+
+        # Pages can overlap if the dataset changes mid-fetch; keep one record per key
+        unique = {tuple(r.get(k) for k in KEY_FIELDS): r for r in records}
+        if len(unique) < len(records):
+            logging.info("Dropped %d duplicate records across pages", len(records) - len(unique))
+
+        logging.info("Fetched %d records from API", len(unique))
+        return list(unique.values())
     except requests.exceptions.RequestException as e:
         logging.error("Request failed: %s", str(e))
         return []
@@ -65,6 +150,39 @@ def fetch_data():
 
 
 # --- DATA PROCESSING ---
+def _isin_ci(series, targets):
+    """
+    Case-insensitive membership mask for a string column. The column is
+    dictionary-encoded first so each distinct value is case-folded once.
+    """
+    cat = series.astype("category")
+    keep = [c for c in cat.cat.categories if str(c).casefold() in targets]
+    return cat.isin(keep)
+
+
+def _to_int32_prices(series):
+    """
+    Coerces a price column to nullable Int32, rounded to whole rupees.
+    Unparseable, infinite or out-of-range values become <NA> rather than
+    failing the cast for the whole batch.
+    """
+    prices = pd.to_numeric(series, errors="coerce").round()
+    return prices.where(prices.between(INT32_MIN, INT32_MAX)).astype("Int32")
+
+
+def _parse_arrival_dates(series):
+    """
+    Parses data.gov.in's DD/MM/YYYY dates with a fixed format so pandas
+    stays on its vectorised parser. Anything that does not match is
+    retried as ISO 8601; values that fail both become NaT.
+    """
+    dates = pd.to_datetime(series, format="%d/%m/%Y", errors="coerce")
+    retry = dates.isna() & series.notna()
+    if retry.any():
+        dates[retry] = pd.to_datetime(series[retry], format="ISO8601", errors="coerce")
+    return dates
+
+
 def process_records(records):
     """
     Converts records to a DataFrame, filters for target commodities,
@@ -74,69 +192,102 @@ def process_records(records):
         logging.info("No records received from API. Returning empty DataFrame.")
         return pd.DataFrame()
 
-    df = pd.DataFrame(records)
-
     req_cols = [
         "arrival_date", "state", "district", "market",
         "commodity", "variety", "min_price", "max_price", "modal_price"
     ]
-    for c in req_cols:
-        if c not in df.columns:
-            df[c] = None
 
-    df = df[req_cols]
+    # Drop other commodities while the records are still plain dicts, so the
+    # DataFrame is only built for rows that can be kept (Case-insensitive check).
+    # Like a categorical, each distinct name is case-folded once, not every row.
+    initial_count = len(records)
+    names = {r.get("commodity") for r in records}
+    wanted = {n for n in names if str(n).casefold() in COMMODITIES_LC}
+    records = [r for r in records if r.get("commodity") in wanted]
+    logging.info("Filtered data. Kept %d records out of %d for %s", len(records), initial_count, ", ".join(COMMODITIES_TO_KEEP))
 
-    # 1. CLEANING: Ensure price columns are numeric and drop invalid prices
-    price_cols = ["min_price", "max_price", "modal_price"]
-    for col in price_cols:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-
-    # Drop rows with NaN or non-positive modal_price
-    df = df.dropna(subset=['modal_price']).copy()
-    initial_count_after_coerce = len(df)
-    df = df[df['modal_price'] > 0].copy()
-    logging.info(f"Filtered out {initial_count_after_coerce - len(df)} records where modal_price <= 0.")
-
-    # 2. Filter by Commodity (Case-insensitive check)
-    initial_count = len(df)
-    df["commodity"] = df["commodity"].astype(str)
-    df = df[df["commodity"].str.lower().isin([c.lower() for c in COMMODITIES_TO_KEEP])].copy()
-    logging.info("Filtered data. Kept %d records out of %d for %s", len(df), initial_count, ", ".join(COMMODITIES_TO_KEEP))
-    
     # Early exit if no commodity data remains
-    if df.empty:
-        return df
-
-    # 3. FILTER BY STATE AND DISTRICT (Robust Case-Insensitive Filtering)
-    maharashtra_count = len(df)
-    
-    # State filter
-    df["state"] = df["state"].astype(str)
-    df = df[df["state"].str.lower() == TARGET_STATE.lower()].copy()
-
-    # District filter
-    target_districts_lower = [d.lower() for d in TARGET_DISTRICTS]
-    df["district"] = df["district"].astype(str)
-    df = df[df["district"].str.lower().isin(target_districts_lower)].copy()
-
-    logging.info("Filtered for %s. Kept %d records out of %d for target districts.", TARGET_STATE, len(df), maharashtra_count)
+    if not records:
+        return pd.DataFrame(columns=req_cols)
 
-    # 4. Filter by Date
-    df["arrival_date"] = pd.to_datetime(df["arrival_date"], errors="coerce", dayfirst=True)
-    df = df.dropna(subset=["arrival_date"])
+    # Missing keys come back as all-NA columns, so no per-column patching is needed
+    df = pd.DataFrame.from_records(records, columns=req_cols, coerce_float=True)
 
+    # 1. CLEANING: Ensure price columns are numeric and drop invalid prices
+    # Prices are whole rupee amounts; nullable Int32 keeps them as 4-byte ints
+    # and makes missing values explicit instead of NaN
+    df[PRICE_COLS] = df[PRICE_COLS].apply(_to_int32_prices)
+
+    # 2. Build one boolean mask for all filters and copy the frame only once.
+    # Missing prices and NaT dates count as False, so they drop out with the mask.
+    mask = df["modal_price"].gt(0).fillna(False).astype(bool)
+    logging.info("Filtered out %d records where modal_price <= 0.", len(df) - mask.sum())
+
+    # Early exit if no priced records remain
+    if not mask.any():
+        return df.loc[mask].copy()
+
+    # 3. State and district (Robust Case-Insensitive Filtering)
+    mask &= _isin_ci(df["state"], {TARGET_STATE_LC})
+    mask &= _isin_ci(df["district"], TARGET_DISTRICTS_LC)
+    logging.info("Kept %d records for target districts in %s.", mask.sum(), TARGET_STATE)
+
+    # 4. Date window
+    df["arrival_date"] = _parse_arrival_dates(df["arrival_date"])
     date_limit = datetime.now() - timedelta(days=DAYS_TO_KEEP)
-    df = df[df["arrival_date"] >= date_limit].copy()
+    mask &= df["arrival_date"] >= date_limit
+
+    df = df.loc[mask].copy()
     logging.info("Further filtered for records in the last %d days. Final count: %d", DAYS_TO_KEEP, len(df))
 
-    df = df.sort_values(by="arrival_date", ascending=False)
+    # API pages arrive close to date order, which the stable (timsort/radix) path
+    # handles in near-linear time; it also keeps ties in API order
+    df = df.sort_values(by="arrival_date", ascending=False, kind="stable")
     return df
 
 
+# --- DATABASE INDEXES ---
+_indexes_ensured = False
+
+
+def ensure_indexes():
+    """
+    Creates the unique compound index used for upserts and the indexes the
+    predictor's latest-record lookup and webapp's /data sort on, once per
+    process.
+    """
+    global _indexes_ensured
+    if _indexes_ensured:
+        return
+
+    col = get_collection()
+    col.create_index([
+        ("commodity", 1),
+        ("variety", 1),
+        ("state", 1),
+        ("district", 1),
+        ("market", 1),
+        ("arrival_date", -1)
+    ], unique=True, name="unique_mandi_price_with_variety")
+    # Equality on district/commodity/variety plus the date sort is an IXSCAN
+    # with the sort served from the index
+    col.create_index([
+        ("district", 1),
+        ("commodity", 1),
+        ("variety", 1),
+        ("arrival_date", -1)
+    ], name="latest_price_lookup")
+    # Backs webapp's /data, which sorts the whole collection by date
+    col.create_index([("arrival_date", -1)], name="arrival_date_desc")
+    _indexes_ensured = True
+    logging.info("Ensured compound indexes exist.")
+
+
 # --- DATABASE STORAGE ---
-def store_mongo(df):
+def store_mongo(df, verify=False):
     """
     Performs a bulk upsert into MongoDB using compound keys as unique identifiers.
+    With verify=True the exact collection size is counted after the write.
     """
     if df.empty:
         logging.info("No records to store.")
@@ -147,56 +298,56 @@ def store_mongo(df):
         return
 
     try:
-        client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+        client = get_client()
         
         # --- CONNECTION CHECK ---
         client.admin.command('ping')
         logging.info("Successfully pinged MongoDB server.")
         
-        db = client[DB_NAME]
-        col = db[COLLECTION_NAME]
-
-        # Ensure index exists for efficient upserts
-        col.create_index([
-            ("commodity", 1),
-            ("variety", 1),
-            ("state", 1),
-            ("district", 1),
-            ("market", 1),
-            ("arrival_date", -1)
-        ], unique=True, name="unique_mandi_price_with_variety")
-
-        logging.info("Ensured unique compound index exists.")
+        col = get_collection()
 
+        # Box the column to datetime objects in one pass and map NaT to None;
+        # the object dtype keeps pandas from inferring it back to datetime64
         df_mongo = df.copy()
-        df_mongo["arrival_date"] = df_mongo["arrival_date"].apply(
-            lambda x: None if pd.isnull(x) else x.to_pydatetime()
-        )
+        ts = df_mongo["arrival_date"]
+        df_mongo["arrival_date"] = ts.astype(object).where(ts.notna(), None)
 
-        docs = df_mongo.to_dict(orient="records")
+        # BSON has no pd.NA; store missing prices as null and the rest as int32
+        prices = df_mongo[PRICE_COLS]
+        df_mongo[PRICE_COLS] = prices.astype(object).where(prices.notna(), None)
 
-        bulk_requests = []
-        for doc in docs:
-            query = {
-                "commodity": doc.get("commodity"),
-                "variety": doc.get("variety"),
-                "state": doc.get("state"),
-                "district": doc.get("district"),
-                "market": doc.get("market"),
-                "arrival_date": doc.get("arrival_date")
-            }
-            update_op = {"$set": doc}
-            bulk_requests.append(UpdateOne(query, update_op, upsert=True))
+        docs = df_mongo.to_dict(orient="records")
+        key_rows = df_mongo[list(KEY_FIELDS)].to_numpy()
+
+        # Each doc carries every stored field, so a full replacement is equivalent
+        # to $set and skips update-operator parsing on the server
+        bulk_requests = [
+            ReplaceOne(dict(zip(KEY_FIELDS, keys)), doc, upsert=True)
+            for keys, doc in zip(key_rows, docs)
+        ]
+
+        upserted = matched = modified = 0
+        for i in range(0, len(bulk_requests), BULK_CHUNK_SIZE):
+            result = col.bulk_write(
+                bulk_requests[i:i + BULK_CHUNK_SIZE],
+                ordered=False,
+                bypass_document_validation=True
+            )
+            upserted += result.upserted_count
+            matched += result.matched_count
+            modified += result.modified_count
 
         if bulk_requests:
-            result = col.bulk_write(bulk_requests, ordered=False)
             logging.info(
-                "Bulk Upsert successful: Upserted %d, Matched %d, Modified %d records.",
-                result.upserted_count, result.matched_count, result.modified_count
+                "Bulk Upsert successful: Sent %d, Upserted %d, Matched %d, Modified %d records.",
+                len(bulk_requests), upserted, matched, modified
             )
 
-        logging.info("Total documents in collection after update: %d", col.count_documents({}))
-        client.close()
+        # The metadata estimate is O(1); an exact count scans the collection
+        if verify or logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.info("Total documents in collection after update: %d", col.count_documents({}))
+        else:
+            logging.info("Estimated documents in collection after update: %d", col.estimated_document_count())
 
     except Exception as e:
         logging.error("MongoDB error: %s", str(e))
@@ -204,7 +355,7 @@ def store_mongo(df):
 
 
 # --- MAIN EXECUTION ---
-def main():
+def main(verify=False):
     """Main function to run the data pipeline."""
     logging.info("Job started")
     records = fetch_data()
@@ -214,9 +365,16 @@ def main():
         return
 
     df = process_records(records)
-    store_mongo(df)
+
+    if MONGO_URI and not df.empty:
+        try:
+            ensure_indexes()
+        except Exception as e:
+            logging.error("Could not ensure indexes: %s", str(e))
+
+    store_mongo(df, verify=verify)
     logging.info("Job finished")
 
 
 if __name__ == "__main__":
-    main()
+    main(verify="--verify" in sys.argv[1:])
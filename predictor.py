@@ -4,111 +4,274 @@
 import pandas as pd
 import numpy as np
 import joblib
-from pymongo import MongoClient
 import os
-import traceback
+import math
+import logging
+import functools
+from db import MONGO_URI, get_collection
 
 # --- 1. CONFIGURATION ---
-MONGO_URI = os.getenv("MONGO_URI")
-DB_NAME = "agriculture_db"
-COLLECTION_NAME = "recent_crop_prices"
 MODEL_DIR = "./models1/"
 
 # --- 2. CONNECT TO MONGODB ---
-if not MONGO_URI:
-    print("FATAL ERROR: MONGO_URI environment variable is not set.")
-    raise ValueError("MONGO_URI not configured.")
-
-try:
-    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=10000)
-    client.admin.command("ismaster")
-    db = client[DB_NAME]
-    collection = db[COLLECTION_NAME]
-    print("Successfully connected to MongoDB.")
-except Exception as e:
-    print(f"FATAL Error connecting to MongoDB: {e}")
-    print(traceback.format_exc())
-    raise ConnectionError(f"Failed to connect to MongoDB at startup: {e}")
-
-
-# --- 3. PREDICTION FUNCTION ---
-def get_live_forecast(district_name, crop_name, variety_name):
+# Importing this module opens no connection. app.py reads through its own
+# Motor client and only calls the forecast_from_* functions, so the API
+# process holds no pymongo client; the sync lookups below connect through
+# db's shared client on first use.
+def _price_collection():
+    """Returns the price collection for the sync lookups."""
+    if not MONGO_URI:
+        raise ValueError("MONGO_URI not configured.")
+    return get_collection()
 
-    print(f"\n--- Forecast Request for: {district_name} - {crop_name} - {variety_name} ---")
 
-    # --- A: Load Correct Model ---
-    model_filename = f"{MODEL_DIR}{district_name.lower()}_{crop_name.lower()}_{variety_name.lower()}_model.joblib"
+# --- 3. PREDICTION FUNCTIONS ---
+def _yesterday_price_terms(model, df):
+    """
+    Splits Prophet's point forecast (yhat) for `df` into a per-day intercept
+    and slope with respect to the "Yesterday Price" regressor, so that
+    yhat = intercept + slope * yesterday_price. Uses one pass of the trend
+    and seasonal-component code with the regressor at 0, plus the fitted
+    coefficient; no uncertainty sampling.
+    """
+    df = model.setup_dataframe(df.assign(**{"Yesterday Price": 0.0}))
+    trend = np.asarray(model.predict_trend(df), dtype=np.float64)
+    components = model.predict_seasonal_components(df)
+    intercept = (
+        trend * (1 + components["multiplicative_terms"].to_numpy())
+        + components["additive_terms"].to_numpy()
+    )
+
+    # Prophet standardizes the regressor, so the per-unit slope is beta / std
+    regressor = model.extra_regressors["Yesterday Price"]
+    col = np.flatnonzero(model.train_component_cols["Yesterday Price"].to_numpy())[0]
+    beta = np.nanmean(model.params["beta"][:, col]) / regressor["std"]
+    if regressor["mode"] == "multiplicative":
+        slope = trend * beta
+    else:
+        slope = np.full_like(trend, beta * model.y_scale)
+    return intercept, slope
+
+
+@functools.lru_cache(maxsize=32)
+def _future_dates(last_date):
+    """
+    The 7 daily dates after `last_date`. Built directly with date_range (no
+    make_future_dataframe over the model history) and memoized, since most
+    series share the same latest arrival date. DatetimeIndex is immutable,
+    so the cached value is safe to share.
+    """
+    return pd.date_range(start=last_date + pd.Timedelta(days=1), periods=7, freq="D")
+
+
+@functools.lru_cache(maxsize=128)
+def _load_model_cached(path, mtime):
+    # joblib detects compression from the file header, so models re-saved by
+    # the optional convert_models.py load the same way as the plain pickles
+    return joblib.load(path)
 
-    try:
-        model = joblib.load(model_filename)
-        print(f"Loaded model: {model_filename}")
-    except FileNotFoundError:
-        print(f"Error: Model file '{model_filename}' not found.")
-        print("This district/crop/variety is not supported yet.")
-        return None
 
-    # --- B: Pull The Latest MongoDB Record ---
-    query = {
+def _load_model(path):
+    """
+    Loads a model file once per process; later requests reuse it from memory.
+    The file's mtime is part of the cache key, so a redeployed model is
+    picked up without a restart.
+    """
+    return _load_model_cached(path, os.path.getmtime(path))
+
+
+# Only the fields the forecast reads are sent back from MongoDB
+LATEST_RECORD_PROJECTION = {
+    "_id": 0, "arrival_date": 1, "modal_price": 1, "min_price": 1, "max_price": 1
+}
+LATEST_RECORD_SORT = [("arrival_date", -1)]
+
+# A record is usable for forecasting when all three prices are finite numbers,
+# modal_price is positive and min/max are non-negative. MongoDB's range
+# operators only match numbers and sort NaN below all of them, so missing,
+# text, NaN and infinite prices are dropped by the query itself.
+VALID_PRICE_FILTER = {
+    "modal_price": {"$gt": 0, "$lt": float("inf")},
+    "min_price": {"$gte": 0, "$lt": float("inf")},
+    "max_price": {"$gte": 0, "$lt": float("inf")},
+}
+
+
+def latest_record_query(district_name, crop_name, variety_name):
+    """MongoDB filter for the price records of one district/crop/variety."""
+    return {
         "commodity": crop_name,
         "variety": variety_name,
         "district": district_name,
     }
 
-    cursor = collection.find(query).sort("arrival_date", -1).limit(1)
-    latest_records = list(cursor)
 
+def latest_valid_record_query(district_name, crop_name, variety_name):
+    """MongoDB filter for the records of one series that pass VALID_PRICE_FILTER."""
+    return {**latest_record_query(district_name, crop_name, variety_name), **VALID_PRICE_FILTER}
+
+
+def features_from_record(record):
+    """
+    Builds the forecast inputs from a valid price record: its date and the
+    log1p of its modal, min and max prices.
+    """
+    return {
+        "arrival_date": record["arrival_date"],
+        "last_known_y_log": math.log1p(record["modal_price"]),
+        "min_price_log": math.log1p(record["min_price"]),
+        "max_price_log": math.log1p(record["max_price"]),
+    }
+
+
+def get_live_forecast(district_name, crop_name, variety_name):
+
+    logging.info("--- Forecast Request for: %s - %s - %s ---", district_name, crop_name, variety_name)
+
+    # One indexed lookup: the price filter skips unusable records server-side,
+    # so the newest match is the record to forecast from
+    record = _price_collection().find_one(
+        latest_valid_record_query(district_name, crop_name, variety_name),
+        LATEST_RECORD_PROJECTION, sort=LATEST_RECORD_SORT
+    )
+
+    return forecast_from_records(district_name, crop_name, variety_name, [record] if record else [])
+
+
+def get_live_forecasts(series):
+    """
+    Forecasts several (district_name, crop_name, variety_name) tuples from one
+    aggregation. Returns {tuple: forecast}, as get_live_forecast would give.
+    """
+    series = list(dict.fromkeys(series))
+    if not series:
+        return {}
+
+    collection = _price_collection()
+    fields = [f for f, keep in LATEST_RECORD_PROJECTION.items() if keep]
+    # The same price filter as the single-series query, so both paths
+    # forecast from the same record. $first after the sort keeps one record
+    # per series, so the group never holds more than len(series) documents
+    pipeline = [
+        {"$match": {"$or": [latest_record_query(*s) for s in series], **VALID_PRICE_FILTER}},
+        {"$sort": {"arrival_date": -1}},
+        {"$group": {
+            "_id": {"district": "$district", "commodity": "$commodity", "variety": "$variety"},
+            "record": {"$first": {f: f"${f}" for f in fields}},
+        }},
+    ]
+
+    latest = {}
+    for doc in collection.aggregate(pipeline):
+        key = doc["_id"]
+        latest[(key["district"], key["commodity"], key["variety"])] = doc["record"]
+
+    return {
+        s: forecast_from_records(*s, [latest[s]] if s in latest else [])
+        for s in series
+    }
+
+
+def forecast_from_records(district_name, crop_name, variety_name, latest_records):
+    """
+    Runs the 7-day forecast from already-fetched MongoDB records (newest
+    first, matched with VALID_PRICE_FILTER). Lets async callers do the query
+    themselves and only hand the blocking model work to a thread.
+    """
     if not latest_records:
-        print(f"No recent data found for {crop_name} - {variety_name} in {district_name}.")
+        logging.info("No recent data found for %s - %s in %s.", crop_name, variety_name, district_name)
         return None
 
-    latest_data = pd.DataFrame(latest_records)
-    print(f"Latest record found: {latest_data['arrival_date'].iloc[0]}")
+    features = features_from_record(latest_records[0])
+    return forecast_from_features(district_name, crop_name, variety_name, features)
 
-    # --- C: Prepare Data ---
-    latest_data["ds"] = pd.to_datetime(latest_data["arrival_date"])
 
-    latest_data["y"] = pd.to_numeric(latest_data["modal_price"], errors="coerce")
-    latest_data["min_price"] = pd.to_numeric(latest_data["min_price"], errors="coerce")
-    latest_data["max_price"] = pd.to_numeric(latest_data["max_price"], errors="coerce")
+def forecast_from_features(district_name, crop_name, variety_name, features):
+    """
+    Runs the 7-day forecast from the output of features_from_record: the last
+    known date and the log1p of its modal, min and max prices.
+    """
 
-    latest_data = latest_data.dropna(subset=["y", "min_price", "max_price"])
+    # --- A: Load Correct Model ---
+    model_filename = f"{MODEL_DIR}{district_name.lower()}_{crop_name.lower()}_{variety_name.lower()}_model.joblib"
+
+    try:
+        model = _load_model(model_filename)
+        logging.info("Loaded model: %s", model_filename)
+    except FileNotFoundError:
+        logging.warning("Model file '%s' not found. This district/crop/variety is not supported yet.", model_filename)
+        return None
 
-    latest_data["y"] = np.log1p(latest_data["y"])
-    latest_data["min_price"] = np.log1p(latest_data["min_price"])
-    latest_data["max_price"] = np.log1p(latest_data["max_price"])
+    # --- B: Use The Latest Known Features ---
+    logging.info("Latest record found: %s", features["arrival_date"])
 
-    last_known_y = latest_data["y"].iloc[0]
-    last_known_min_price = latest_data["min_price"].iloc[0]
-    last_known_max_price = latest_data["max_price"].iloc[0]
+    # --- C: Prepare Data ---
+    # The prices are stored already log1p-transformed
+    last_known_y = features["last_known_y_log"]
+    last_known_min_price = features["min_price_log"]
+    last_known_max_price = features["max_price_log"]
 
     # --- D: FIX — Generate Future Dates Based on the Latest MongoDB Date ---
-    last_date = latest_data["ds"].iloc[0]
-    future_dates = pd.date_range(start=last_date + pd.Timedelta(days=1), periods=7)
-
-    future_df = pd.DataFrame({"ds": future_dates})
+    # Mongo hands back a datetime already; pd.Timestamp only wraps it
+    last_date = pd.Timestamp(features["arrival_date"])
+    future_dates = _future_dates(last_date)
 
     # --- E: Recursive Forecast Setup ---
-    future_df["min_price"] = last_known_min_price
-    future_df["max_price"] = last_known_max_price
-    future_df["Yesterday Price"] = np.nan
-    future_df.loc[future_df.index[0], "Yesterday Price"] = last_known_y
+    future_df = pd.DataFrame({
+        "ds": future_dates,
+        "min_price": last_known_min_price,
+        "max_price": last_known_max_price,
+        "Yesterday Price": [last_known_y] + [np.nan] * 6,
+    })
+
+    logging.info("Running recursive forecast for the next 7 days...")
 
-    print("Running recursive forecast for the next 7 days...")
+    if "Yesterday Price" in getattr(model, "extra_regressors", {}):
+        # yhat is affine in each regressor, so one batched pass gives every
+        # day's intercept and slope w.r.t. "Yesterday Price"; the recursion
+        # itself is then plain arithmetic instead of 7 predict() calls
+        intercept, slope = _yesterday_price_terms(model, future_df)
 
-    for i in range(7):
-        row = future_df.iloc[[i]]
-        forecast = model.predict(row)
-        predicted_y_log = forecast["yhat"].iloc[0]
+        yesterday = np.empty(7, dtype=np.float64)
+        yesterday[0] = last_known_y
+        for i in range(6):
+            yesterday[i + 1] = intercept[i] + slope[i] * yesterday[i]
+        future_df["Yesterday Price"] = yesterday
+    else:
+        # Carry the recursion in a NumPy buffer and write the column once at
+        # the end, instead of a pandas label lookup + setitem per step
+        yesterday = np.empty(7, dtype=np.float64)
+        yesterday[0] = last_known_y
+        # One reusable 1-row frame; only its date and Yesterday Price change
+        # per step (min/max prices are the same on every row)
+        row_df = future_df.iloc[[0]].copy()
+        ds_col = future_df.columns.get_loc("ds")
+        yp_col = future_df.columns.get_loc("Yesterday Price")
+        # predict() lays out its columns the same way every call, so the
+        # yhat position is looked up once from the first forecast
+        yhat_col = None
+        for i in range(7):
+            row_df.iat[0, ds_col] = future_df.iat[i, ds_col]
+            row_df.iat[0, yp_col] = yesterday[i]
+            forecast = model.predict(row_df)
+            if yhat_col is None:
+                yhat_col = forecast.columns.get_loc("yhat")
+            predicted_y_log = forecast.iat[0, yhat_col]
 
-        if i < 6:
-            future_df.loc[future_df.index[i + 1], "Yesterday Price"] = predicted_y_log
+            if i < 6:
+                yesterday[i + 1] = predicted_y_log
+        future_df["Yesterday Price"] = yesterday
 
     # --- F: Final Forecast ---
     final_forecast = model.predict(future_df)
 
-    final_forecast["predicted_price"] = np.expm1(final_forecast["yhat"])
-    final_forecast["yhat_lower"] = np.expm1(final_forecast["yhat_lower"])
-    final_forecast["yhat_upper"] = np.expm1(final_forecast["yhat_upper"])
+    # Back-transform all three columns with one ufunc call on a 2-D block
+    prices = np.expm1(final_forecast[["yhat", "yhat_lower", "yhat_upper"]].to_numpy(dtype=np.float64))
 
-    return final_forecast[["ds", "predicted_price", "yhat_lower", "yhat_upper"]]
+    return pd.DataFrame({
+        "ds": final_forecast["ds"].to_numpy(),
+        "predicted_price": prices[:, 0],
+        "yhat_lower": prices[:, 1],
+        "yhat_upper": prices[:, 2],
+    })
 
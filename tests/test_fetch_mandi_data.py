@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pandas as pd
+
+import fetch_mandi_data
+
+
+def _record(**overrides):
+    record = {
+        "arrival_date": datetime.now().strftime("%d/%m/%Y"),
+        "state": "Maharashtra",
+        "district": "Pune",
+        "market": "Pune",
+        "commodity": "Onion",
+        "variety": "Red",
+        "min_price": "1000",
+        "max_price": "2000",
+        "modal_price": "1500",
+    }
+    record.update(overrides)
+    return record
+
+
+def test_process_records_nulls_unusable_prices_instead_of_failing():
+    records = [
+        _record(market="Decimal", min_price="1000.6", max_price="2000.4", modal_price="1500.5"),
+        _record(market="Overflow", max_price="99999999999", modal_price="1600"),
+        _record(market="Infinite", min_price="inf", modal_price="1700"),
+        _record(market="Text", min_price="n/a", modal_price="1800"),
+    ]
+
+    df = fetch_mandi_data.process_records(records).set_index("market")
+
+    for col in fetch_mandi_data.PRICE_COLS:
+        assert df[col].dtype == "Int32"
+    assert df.loc["Decimal", "min_price"] == 1001
+    assert df.loc["Decimal", "max_price"] == 2000
+    assert df.loc["Overflow", "modal_price"] == 1600
+    assert pd.isna(df.loc["Overflow", "max_price"])
+    assert pd.isna(df.loc["Infinite", "min_price"])
+    assert pd.isna(df.loc["Text", "min_price"])
+
+
+def test_process_records_drops_rows_whose_modal_price_is_unusable():
+    records = [
+        _record(market="Good"),
+        _record(market="Overflow", modal_price="1e12"),
+        _record(market="Zero", modal_price="0"),
+    ]
+
+    df = fetch_mandi_data.process_records(records)
+
+    assert df["market"].tolist() == ["Good"]
+
+
+def _fake_pages(monkeypatch, total=None):
+    monkeypatch.setattr(fetch_mandi_data, "API_KEY", "test-key")
+    monkeypatch.setattr(fetch_mandi_data, "LIMIT", 2)
+    monkeypatch.setattr(fetch_mandi_data, "MAX_PAGES", 3)
+
+    def fetch_page(offset):
+        payload = {"records": [_record(market=f"M{offset + i}") for i in range(2)]}
+        if total is not None:
+            payload["total"] = total
+        return payload
+
+    monkeypatch.setattr(fetch_mandi_data, "_fetch_page", fetch_page)
+
+
+def test_fetch_data_warns_when_total_exceeds_the_page_cap(monkeypatch, caplog):
+    _fake_pages(monkeypatch, total=100)
+
+    records = fetch_mandi_data.fetch_data()
+
+    assert len(records) == 6
+    assert "API reports 100 records" in caplog.text
+    assert "fetched 6 records" in caplog.text
+
+
+def test_fetch_data_warns_when_sequential_paging_hits_the_cap(monkeypatch, caplog):
+    _fake_pages(monkeypatch)
+
+    records = fetch_mandi_data.fetch_data()
+
+    assert len(records) == 6
+    assert "Stopped after 3 pages" in caplog.text
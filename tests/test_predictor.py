@@ -0,0 +1,176 @@
+import math
+import numbers
+import operator
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import predictor
+
+
+_RANGE_OPS = {"$gt": operator.gt, "$gte": operator.ge, "$lt": operator.lt}
+
+
+def _matches(doc, query):
+    """Equality and $gt/$gte/$lt matching with MongoDB's number-only, NaN-excluding range semantics."""
+    for field, condition in query.items():
+        value = doc.get(field)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+            continue
+        if isinstance(value, bool) or not isinstance(value, numbers.Real) or math.isnan(value):
+            return False
+        if not all(_RANGE_OPS[op](value, bound) for op, bound in condition.items()):
+            return False
+    return True
+
+
+class _FakePriceCollection:
+    """In-memory stand-in for the price collection, covering the queries predictor issues."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find_one(self, query, projection, sort):
+        (field, direction), = sort
+        docs = sorted(
+            (d for d in self.docs if _matches(d, query)),
+            key=lambda d: d[field], reverse=direction < 0
+        )
+        if not docs:
+            return None
+        return {k: docs[0][k] for k, keep in projection.items() if keep and k in docs[0]}
+
+    def aggregate(self, pipeline):
+        # Mirrors the expected $match -> $sort -> $group($first) shape; the
+        # real pipeline is not run against a server here
+        match, sort, group = pipeline
+        conditions = {k: v for k, v in match["$match"].items() if k != "$or"}
+        docs = [
+            d for d in self.docs
+            if _matches(d, conditions) and any(_matches(d, q) for q in match["$match"]["$or"])
+        ]
+        docs.sort(key=lambda d: d["arrival_date"], reverse=sort["$sort"]["arrival_date"] < 0)
+
+        first = group["$group"]["record"]["$first"]
+        groups = {}
+        for d in docs:
+            key = (d["district"], d["commodity"], d["variety"])
+            groups.setdefault(key, {k: d[v[1:]] for k, v in first.items() if v[1:] in d})
+
+        return [
+            {"_id": {"district": k[0], "commodity": k[1], "variety": k[2]}, "record": record}
+            for k, record in groups.items()
+        ]
+
+
+def test_get_live_forecasts_pipeline_keeps_one_record_per_series(monkeypatch):
+    pipelines = []
+
+    class _RecordingCollection:
+        def aggregate(self, pipeline):
+            pipelines.append(pipeline)
+            return []
+
+    monkeypatch.setattr(predictor, "_price_collection", lambda: _RecordingCollection())
+    predictor.get_live_forecasts([("Pune", "Onion", "Red")])
+
+    (pipeline,) = pipelines
+    assert [next(iter(stage)) for stage in pipeline] == ["$match", "$sort", "$group"]
+    assert pipeline[0]["$match"]["modal_price"] == predictor.VALID_PRICE_FILTER["modal_price"]
+    assert pipeline[1]["$sort"] == {"arrival_date": -1}
+    # A bounded accumulator: nothing that collects a series' whole history
+    accumulators = {next(iter(v)) for k, v in pipeline[2]["$group"].items() if k != "_id"}
+    assert accumulators == {"$first"}
+
+
+def test_get_live_forecasts_matches_get_live_forecast(monkeypatch):
+    def price(district, variety, day, modal, min_price=900):
+        return {
+            "district": district, "commodity": "Onion", "variety": variety,
+            "arrival_date": datetime(2024, 3, day),
+            "modal_price": modal, "min_price": min_price, "max_price": 1100,
+        }
+
+    docs = [
+        price("Pune", "Red", 1, 1000),
+        price("Pune", "Red", 2, 1200),
+        # Newer Nashik records have unusable prices; the oldest one is used
+        price("Nashik", "Other", 1, 1500),
+        price("Nashik", "Other", 2, 1600, min_price=-1),
+        price("Nashik", "Other", 3, "1700"),
+        price("Nashik", "Other", 4, float("nan")),
+        price("Nashik", "Other", 5, 0),
+        price("Nagpur", "Red", 1, 1100),
+    ]
+    monkeypatch.setattr(predictor, "_price_collection", lambda: _FakePriceCollection(docs))
+    monkeypatch.setattr(
+        predictor, "forecast_from_features",
+        lambda district, crop, variety, features: (district, crop, variety, features)
+    )
+    series = [("Pune", "Onion", "Red"), ("Nashik", "Onion", "Other"), ("Thane", "Onion", "Red")]
+
+    batch = predictor.get_live_forecasts(series)
+
+    assert batch == {s: predictor.get_live_forecast(*s) for s in series}
+    assert batch[("Pune", "Onion", "Red")][3]["arrival_date"] == datetime(2024, 3, 2)
+    assert batch[("Nashik", "Onion", "Other")][3]["arrival_date"] == datetime(2024, 3, 1)
+    assert batch[("Nashik", "Onion", "Other")][3]["last_known_y_log"] == pytest.approx(np.log1p(1500))
+    assert batch[("Thane", "Onion", "Red")] is None
+
+
+def _fit_model(mode):
+    prophet = pytest.importorskip("prophet")
+    rng = np.random.default_rng(0)
+    ds = pd.date_range("2024-01-01", periods=90, freq="D")
+    y = 7.5 + 0.1 * np.sin(np.arange(90) / 5) + rng.normal(0, 0.02, 90)
+    history = pd.DataFrame({
+        "ds": ds,
+        "y": y,
+        "min_price": y - 0.2 + rng.normal(0, 0.01, 90),
+        "max_price": y + 0.2 + rng.normal(0, 0.01, 90),
+        "Yesterday Price": np.r_[y[0], y[:-1]],
+    })
+    model = prophet.Prophet(seasonality_mode=mode, daily_seasonality=False)
+    model.add_regressor("min_price")
+    model.add_regressor("max_price")
+    model.add_regressor("Yesterday Price", mode=mode)
+    return model.fit(history)
+
+
+def _iterative_yesterday_prices(model, future_df, last_known_y):
+    """The original recursion: one predict() per day, feeding yhat forward."""
+    yesterday = [last_known_y]
+    for i in range(len(future_df) - 1):
+        row = future_df.iloc[[i]].assign(**{"Yesterday Price": yesterday[i]})
+        yesterday.append(model.predict(row)["yhat"].iloc[0])
+    return np.array(yesterday)
+
+
+@pytest.mark.parametrize("mode", ["additive", "multiplicative"])
+def test_closed_form_recursion_matches_iterative_predict(mode, monkeypatch):
+    model = _fit_model(mode)
+    features = {
+        "arrival_date": pd.Timestamp("2024-03-30"),
+        "last_known_y_log": 7.55,
+        "min_price_log": 7.3,
+        "max_price_log": 7.7,
+    }
+    future_df = pd.DataFrame({
+        "ds": pd.date_range("2024-03-31", periods=7, freq="D"),
+        "min_price": features["min_price_log"],
+        "max_price": features["max_price_log"],
+        "Yesterday Price": [features["last_known_y_log"]] + [np.nan] * 6,
+    })
+    expected = _iterative_yesterday_prices(model, future_df, features["last_known_y_log"])
+    expected_yhat = model.predict(future_df.assign(**{"Yesterday Price": expected}))["yhat"]
+
+    intercept, slope = predictor._yesterday_price_terms(model, future_df)
+    np.testing.assert_allclose(intercept + slope * expected, expected_yhat, rtol=1e-9, atol=1e-9)
+
+    monkeypatch.setattr(predictor, "_load_model", lambda path: model)
+    forecast = predictor.forecast_from_features("pune", "onion", "red", features)
+    np.testing.assert_allclose(forecast["predicted_price"], np.expm1(expected_yhat), rtol=1e-9)
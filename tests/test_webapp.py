@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import orjson
+from pymongo.errors import ServerSelectionTimeoutError
+
+import webapp
+
+
+class _FakeCursor:
+    def __init__(self, docs=(), error=None):
+        self.docs = list(docs)
+        self.error = error
+
+    def sort(self, *args):
+        return self
+
+    def limit(self, n):
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __iter__(self):
+        if self.error is not None:
+            raise self.error
+        return iter(self.docs)
+
+
+class _FakeCollection:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def find(self, query, projection):
+        return self.cursor
+
+
+def _get_data(monkeypatch, cursor):
+    monkeypatch.setattr(webapp, "client", object())
+    monkeypatch.setattr(webapp, "get_collection", lambda: _FakeCollection(cursor))
+    return webapp.app.test_client().get("/data")
+
+
+def test_data_streams_documents_as_a_json_array(monkeypatch):
+    docs = [
+        {"district": "Pune", "modal_price": 1500, "arrival_date": datetime(2024, 3, 2)},
+        {"district": "Nashik", "modal_price": 1400, "arrival_date": datetime(2024, 3, 1)},
+    ]
+
+    response = _get_data(monkeypatch, _FakeCursor(docs))
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    body = orjson.loads(response.get_data())
+    assert [d["district"] for d in body] == ["Pune", "Nashik"]
+    assert body[0]["arrival_date"] == "Sat, 02 Mar 2024 00:00:00 GMT"
+
+
+def test_data_returns_empty_array_when_collection_is_empty(monkeypatch):
+    response = _get_data(monkeypatch, _FakeCursor())
+
+    assert response.status_code == 200
+    assert orjson.loads(response.get_data()) == []
+
+
+def test_data_query_failure_is_a_500_not_a_truncated_200(monkeypatch):
+    cursor = _FakeCursor(error=ServerSelectionTimeoutError("no servers available"))
+
+    response = _get_data(monkeypatch, cursor)
+
+    assert response.status_code == 500
+    assert orjson.loads(response.get_data()) == {"error": "DB query failed"}
@@ -1,23 +1,63 @@
-from flask import Flask, jsonify
+from datetime import datetime
+from flask import Flask, Response, jsonify
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+import orjson
 import os
-import pymongo
 import logging
+from db import MONGO_URI, get_client, get_collection
+
+
+def _orjson_default(obj):
+    # Keep Flask's HTTP-date format for datetimes so /data output is unchanged
+    if isinstance(obj, datetime):
+        return http_date(obj)
+    return str(obj)
+
+
+# Compact output in insertion order: orjson never sorts keys or indents
+# unless asked (no OPT_SORT_KEYS / OPT_INDENT_2), and writes UTF-8 directly
+# instead of \u-escaping non-ASCII text. OPT_NON_STR_KEYS accepts int or
+# date dict keys instead of raising.
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, default=_orjson_default, option=ORJSON_OPTIONS)
+
+
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider that encodes with orjson instead of the stdlib json."""
+
+    def dumps(self, obj, **kwargs):
+        return _orjson_dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
-MONGO_URI = os.getenv("MONGO_URI")
 if not MONGO_URI:
     logging.error("MONGO_URI not set in environment!")
     # app will still start but DB endpoints may fail
 
+# Fields returned by /data; everything else (including _id) stays on the server
+DATA_PROJECTION = {
+    "_id": 0, "arrival_date": 1, "state": 1, "district": 1, "market": 1,
+    "commodity": 1, "variety": 1, "min_price": 1, "max_price": 1, "modal_price": 1
+}
+
 client = None
 try:
     if MONGO_URI:
-        client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+        client = get_client()
         # Try to fetch server info to confirm connection
         client.server_info()
         logging.info("Connected to MongoDB Atlas.")
+        logging.info("MongoDB pool options: %s", client.options.pool_options)
 except Exception as e:
     logging.error("Could not connect to MongoDB: %s", str(e))
     client = None
@@ -33,14 +73,36 @@ def get_data():
     if not client:
         return jsonify({"error": "DB not connected"}), 500
 
-    db = client["agriculture_db"]
-    col = db["recent_crop_prices"]
+    col = get_collection()
+
+    # batch_size matches the limit so the whole result comes back in one batch
+    cursor = (col.find({}, DATA_PROJECTION)
+              .sort("arrival_date", -1)
+              .limit(200)
+              .batch_size(200))
+
+    # Pull the first document before any bytes are sent, so connection, auth
+    # and query errors still get a proper error response. With batch_size
+    # equal to the limit, that first fetch brings back the whole result
+    try:
+        docs = iter(cursor)
+        first = next(docs, None)
+    except Exception as e:
+        logging.error("MongoDB query for /data failed: %s", str(e))
+        return jsonify({"error": "DB query failed"}), 500
 
-    docs = list(col.find({}, {"_id": 0})
-                .sort("arrival_date", -1)
-                .limit(200))
+    # Encode and send one document at a time instead of building the full
+    # list and then the full JSON string before the first byte goes out
+    def generate():
+        yield b"["
+        if first is not None:
+            yield _orjson_dumps(first)
+            for doc in docs:
+                yield b","
+                yield _orjson_dumps(doc)
+        yield b"]"
 
-    return jsonify(docs)
+    return Response(generate(), mimetype="application/json")
 
 
 if __name__ == "__main__":